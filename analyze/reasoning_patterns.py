@@ -4,7 +4,6 @@ import networkx as nx
 from typing import Any, List, Dict, Union
 from core.get_paths import directed_decision_free_path, find_all_dir_paths, find_all_undir_paths, get_motif, \
     is_active_indirect_frontdoor_trail, is_active_path
-import copy
 
 
 def _get_key_node(mb: MACIDBase, path: List[str]) -> str:
@@ -134,9 +133,8 @@ def manipulation(macid: MACID, decision: str, effective_set: List[str]) -> bool:
     agent = macid.whose_node[decision]
     agent_utils = macid.utility_nodes_agent[agent]
     reachable_decisions = []    # set of possible D_B
-    list_decs = copy.deepcopy(macid.all_decision_nodes)
-    list_decs.remove(decision)
-    for dec_reach in list_decs:
+    other_decs = [dec for dec in macid.all_decision_nodes if dec != decision]
+    for dec_reach in other_decs:
         if dec_reach in effective_set:
             if directed_decision_free_path(macid, decision, dec_reach):
                 reachable_decisions.append(dec_reach)
@@ -174,33 +172,31 @@ def signaling(macid: MACID, decision: str, effective_set: List[str]) -> bool:
     agent = macid.whose_node[decision]
     agent_utils = macid.utility_nodes_agent[agent]
     reachable_decisions = []    # set of possible D_B
-    list_decs = copy.deepcopy(macid.all_decision_nodes)
-    list_decs.remove(decision)
-    for dec_reach in list_decs:
+    other_decs = [dec for dec in macid.all_decision_nodes if dec != decision]
+    for dec_reach in other_decs:
         if dec_reach in effective_set:
             if directed_decision_free_path(macid, decision, dec_reach):
                 reachable_decisions.append(dec_reach)
 
+    decision_descendants = nx.descendants(macid, decision)
     for decision_b in reachable_decisions:
         agent_b = macid.whose_node[decision_b]
         agent_b_utils = macid.utility_nodes_agent[agent_b]
+        decision_b_parents_not_desc_decision = [node for node in macid.get_parents(decision_b)
+                                                if node not in decision_descendants]
+        cond_nodes = [decision_b] + decision_b_parents_not_desc_decision
         for u in agent_utils:
             if _effective_dir_path_exists(macid, decision_b, u, effective_set):
                 for u_b in agent_b_utils:
-
-                    decision_b_parents_not_desc_decision = [node for node in macid.get_parents(decision_b)
-                                                            if node not in set(nx.descendants(macid, decision))]
-                    cond_nodes = [decision_b] + decision_b_parents_not_desc_decision
-
-                    if _effective_backdoor_path_not_blocked_by_set_w(macid, decision, u_b, effective_set, cond_nodes):
-                        path = _effective_backdoor_path_not_blocked_by_set_w(macid, decision, u_b, effective_set,
-                                                                             cond_nodes)
-                        if _get_key_node(macid, path):
-                            key_node = _get_key_node(macid, path)
-                        else:
+                    path = _effective_backdoor_path_not_blocked_by_set_w(macid, decision, u_b, effective_set,
+                                                                         cond_nodes)
+                    if path:
+                        key_node = _get_key_node(macid, path)
+                        if not key_node:
                             return False
+                        key_node_descendants = nx.descendants(macid, key_node)
                         decision_parents_not_desc_key_node = [node for node in macid.get_parents(decision)
-                                                              if node not in set(nx.descendants(macid, key_node))]
+                                                              if node not in key_node_descendants]
                         cond_nodes2 = [decision] + decision_parents_not_desc_key_node
 
                         if _effective_undir_path_not_blocked_by_set_w(macid, key_node, u, effective_set, cond_nodes2):
@@ -226,24 +222,24 @@ def revealing_or_denying(macid: MACID, decision: str, effective_set: List[str])
     agent = macid.whose_node[decision]
     agent_utils = macid.utility_nodes_agent[agent]
     reachable_decisions = []    # set of possible D_B
-    list_decs = copy.deepcopy(macid.all_decision_nodes)
-    list_decs.remove(decision)
-    for dec_reach in list_decs:
+    other_decs = [dec for dec in macid.all_decision_nodes if dec != decision]
+    for dec_reach in other_decs:
         if dec_reach in effective_set:
             if directed_decision_free_path(macid, decision, dec_reach):
                 reachable_decisions.append(dec_reach)
 
+    decision_descendants = nx.descendants(macid, decision)
     for decision_b in reachable_decisions:
         agent_b = macid.whose_node[decision_b]
         agent_b_utils = macid.utility_nodes_agent[agent_b]
+        decision_b_parents_not_desc_decision = [node for node in macid.get_parents(decision_b)
+                                                if node not in decision_descendants]
+        cond_nodes = [decision_b] + decision_b_parents_not_desc_decision
 
         for u in agent_utils:
             if _effective_dir_path_exists(macid, decision_b, u, effective_set):
 
                 for u_b in agent_b_utils:
-                    decision_b_parents_not_desc_decision = [node for node in macid.get_parents(decision_b)
-                                                            if node not in set(nx.descendants(macid, decision))]
-                    cond_nodes = [decision_b] + decision_b_parents_not_desc_decision
                     if is_active_indirect_frontdoor_trail(macid, decision, u_b, cond_nodes):
                         return True
     else:
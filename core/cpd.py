@@ -5,7 +5,7 @@ from __future__ import annotations
 import itertools
 from inspect import getsourcelines
 import random
-from typing import List, Callable, Dict
+from typing import List, Callable, Dict, Tuple
 from pgmpy.factors.discrete import TabularCPD  # type: ignore
 from pgmpy.models import BayesianModel  # type: ignore
 import numpy as np
@@ -96,6 +96,19 @@ class FunctionCPD(TabularCPD):
         state_names = {self.variable: self.force_state_names} if self.force_state_names else None
         return FunctionCPD(self.variable, self.f, self.evidence, state_names=state_names)
 
+    def signature(self) -> Tuple:
+        """A hashable summary of the initialized probability table
+
+        Two FunctionCPDs with the same signature specify the same conditional distribution,
+        even if they were created from different function objects.
+        """
+        if not hasattr(self, "values"):
+            raise Exception(f"FunctionCPD {self.variable} must be initialized before computing its signature")
+        return (self.variable, tuple(self.variables[1:]),
+                tuple(self.state_names[self.variable]),
+                tuple(tuple(self.evidence_state_names[p]) for p in self.variables[1:]),
+                self.get_values().tobytes())
+
     def __repr__(self) -> str:
         return "<FunctionCPD {}:{}>".format(self.variable, self.f)
 
@@ -133,7 +146,10 @@ class FunctionCPD(TabularCPD):
         """
         if not self.parents_instantiated(cid):
             return False
-        poss_values = self.possible_values(cid)
+        parent_values = self.parent_values(cid)
+        # evaluate the function once for each combination of parent values
+        outputs = [self.f(*x) for x in itertools.product(*parent_values)]
+        poss_values = sorted(set(outputs))
         if self.force_state_names:
             state_names_list = self.force_state_names
             if not set(poss_values).issubset(state_names_list):
@@ -142,12 +158,14 @@ class FunctionCPD(TabularCPD):
             state_names_list = poss_values
 
         card = len(state_names_list)
-        evidence = cid.get_parents(self.variable)
+        # the columns of the matrix follow the order of self.evidence, which may differ from the graph's
+        evidence = self.evidence
         evidence_card = [cid.get_cardinality(p) for p in evidence]
-        matrix = np.array([[int(self.f(*i) == t)
-                            for i in itertools.product(*self.parent_values(cid))]
-                           for t in state_names_list])
+        state_index = {t: i for i, t in enumerate(state_names_list)}
+        matrix = np.zeros((card, len(outputs)), dtype=int)
+        matrix[[state_index[output] for output in outputs], np.arange(len(outputs))] = 1
         state_names = {self.variable: state_names_list}
+        self.evidence_state_names = dict(zip(self.evidence, parent_values))
 
         super().__init__(self.variable, card,
                          matrix, evidence, evidence_card,
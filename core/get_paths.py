@@ -156,7 +156,8 @@ def directed_decision_free_path(mb: MACIDBase, start_node: str, end_node: str) -
             raise Exception(f"The node {node} is not in the (MA)CID")
 
     start_to_end_paths = find_all_dir_paths(mb, start_node, end_node)
-    dec_free_path_exists = any(set(mb.all_decision_nodes).isdisjoint(set(path[1:-1]))
+    all_decision_nodes = set(mb.all_decision_nodes)
+    dec_free_path_exists = any(all_decision_nodes.isdisjoint(set(path[1:-1]))
                                for path in start_to_end_paths)  # ignore path's start_node and end_node
     if start_to_end_paths and dec_free_path_exists:
         return True
@@ -2,15 +2,11 @@
 # agreements; and to You under the Apache License, Version 2.0.
 from __future__ import annotations
 from core.cpd import FunctionCPD
-import numpy as np
-from typing import List, Tuple, Dict, Union, Optional
+from typing import List, Tuple, Dict, Union, Optional, Iterator, Set
 import itertools
 import networkx as nx
-import copy
-import matplotlib.cm as cm
 from core.macid_base import MACIDBase
 from core.relevance_graph import CondensedRelevanceGraph
-from core.cpd import DecisionDomain
 
 
 class MACID(MACIDBase):
@@ -26,9 +22,13 @@ class MACID(MACIDBase):
         """
         return self.get_all_pure_ne_in_sg()
 
-    def joint_pure_strategies(self, decisions: List[str]) -> List[FunctionCPD]:
+    def joint_pure_strategies(self, decisions: List[str]) -> Iterator[Tuple[FunctionCPD, ...]]:
+        """
+        Return an iterator over all joint pure strategies for the given decisions.
+        - The strategies are generated lazily, so the full product is never held in memory.
+        """
         all_dec_decision_rules = list(map(self.pure_decision_rules, decisions))
-        return list(itertools.product(*all_dec_decision_rules))
+        return itertools.product(*all_dec_decision_rules)
 
     def get_all_pure_ne_in_sg(self, decisions_in_sg: Optional[List[str]] = None) -> List[List[FunctionCPD]]:
         """
@@ -43,35 +43,104 @@ class MACID(MACIDBase):
             decisions_in_sg = self.all_decision_nodes
 
         for dec in decisions_in_sg:
-            if dec not in self.all_decision_nodes:
+            if dec not in self._decision_set:
                 raise Exception(f"The node {dec} is not a decision node in the (MACID")
 
-        agents_in_sg = list({self.whose_node[dec] for dec in decisions_in_sg})
-        agent_decs_in_sg = {agent: [dec for dec in self.decision_nodes_agent[agent]
-                            if dec in decisions_in_sg] for agent in agents_in_sg}
-
         # impute random decisions to non-instantiated, irrelevant decision nodes
         macid = self.copy()
-        for d in macid.all_decision_nodes:
-            if not macid.is_s_reachable(decisions_in_sg, d) and isinstance(macid.get_cpds(d), DecisionDomain):
-                macid.impute_random_decision(d)
-
-        # NE finder
-        all_pure_ne_in_sg: List[List[FunctionCPD]] = []
-        for pp in self.joint_pure_strategies(decisions_in_sg):
-            macid.add_cpds(*pp)  # impute the strategy profile
-
-            for a in agents_in_sg:  # check that each agent is happy
-                eu_pp_agent_a = macid.expected_utility({}, agent=a)
-                macid.add_cpds(*macid.optimal_pure_strategies(agent_decs_in_sg[a])[0])
-                max_eu_agent_a = macid.expected_utility({}, agent=a)
+        macid._impute_random_to_irrelevant_decisions(decisions_in_sg)
+        return macid._get_all_pure_ne_in_prepared_sg(decisions_in_sg)  # type: ignore
 
-                if max_eu_agent_a > eu_pp_agent_a:  # not an NE
-                    break
-            else:  # it's an NE
-                all_pure_ne_in_sg.append(list(pp))
-
-        return all_pure_ne_in_sg
+    def _get_all_pure_ne_in_prepared_sg(self, decisions_in_sg: List[str]) -> List[List[FunctionCPD]]:
+        """
+        Return a list of all pure Nash equilbiria in a MACID subgame, modifying the CPDs of this MACID.
+        - This assumes that random decisions have already been imputed to the non-instantiated decision
+        nodes that are irrelevant to the subgame.
+        """
+        agent_decs_in_sg: Dict[Union[str, int], List[str]] = {}
+        for dec in decisions_in_sg:
+            agent_decs_in_sg.setdefault(self.whose_node[dec], []).append(dec)
+        agents_in_sg = list(agent_decs_in_sg)
+        if not agents_in_sg:
+            return [[]]
+
+        # initialize every decision rule once, so that profiles can be swapped in without add_cpds
+        decision_rules = {d: self.pure_decision_rules(d) for d in decisions_in_sg}
+        for rules in decision_rules.values():
+            for rule in rules:
+                if not rule.initialize_tabular_cpd(self):
+                    raise Exception(f"The parents of {rule.variable} have not all been instantiated")
+
+        # NE finder: a profile is an NE iff every agent's component is a best response to the others'.
+        # The candidates are the first agent's best responses: each later agent only needs to rule out the
+        # remaining candidates in which it has a profitable deviation.
+        eu_cache: Dict[Tuple[int, ...], Dict[Union[str, int], float]] = {}
+        first_agent, *other_agents = agents_in_sg
+        ne_indices = self._pure_best_responses(first_agent, agent_decs_in_sg[first_agent], decisions_in_sg,
+                                               decision_rules, agents_in_sg, eu_cache)
+        for a in other_agents:
+            ne_indices = {idx for idx in ne_indices
+                          if not self._has_profitable_deviation(idx, a, agent_decs_in_sg[a], decisions_in_sg,
+                                                                decision_rules, agents_in_sg, eu_cache)}
+
+        return [[decision_rules[d][i] for d, i in zip(decisions_in_sg, idx)] for idx in sorted(ne_indices)]
+
+    def _pure_best_responses(self, agent: Union[str, int], agent_decs: List[str], decisions: List[str],
+                             decision_rules: Dict[str, List[FunctionCPD]], agents: List[Union[str, int]],
+                             eu_cache: Dict[Tuple[int, ...], Dict[Union[str, int], float]]) -> Set[Tuple[int, ...]]:
+        """
+        Return the joint pure strategies over decisions in which agent's decision rules are a best response.
+        - Strategies are given as tuples of indices into decision_rules, ordered like decisions.
+        - For each profile of the other agents' decision rules, agent's best responses are found by
+        trying each of agent's joint pure strategies.
+        """
+        agent_decs_set = set(agent_decs)
+        other_decs = [d for d in decisions if d not in agent_decs_set]
+        best_responses: Set[Tuple[int, ...]] = set()
+        for others_idx in itertools.product(*[range(len(decision_rules[d])) for d in other_decs]):
+            eu: Dict[Tuple[int, ...], float] = {}
+            for agent_idx in itertools.product(*[range(len(decision_rules[d])) for d in agent_decs]):
+                profile = dict(zip(other_decs, others_idx))
+                profile.update(zip(agent_decs, agent_idx))
+                profile_idx = tuple(profile[d] for d in decisions)
+                eu[profile_idx] = self._profile_expected_utilities(profile_idx, decisions, decision_rules,
+                                                                   agents, eu_cache)[agent]
+            max_eu = max(eu.values())
+            best_responses.update(idx for idx, agent_eu in eu.items() if agent_eu == max_eu)
+        return best_responses
+
+    def _has_profitable_deviation(self, profile_idx: Tuple[int, ...], agent: Union[str, int], agent_decs: List[str],
+                                  decisions: List[str], decision_rules: Dict[str, List[FunctionCPD]],
+                                  agents: List[Union[str, int]],
+                                  eu_cache: Dict[Tuple[int, ...], Dict[Union[str, int], float]]) -> bool:
+        """
+        Return True if agent can strictly improve its expected utility by changing its component of the profile.
+        - The search stops at the first profitable deviation found.
+        """
+        baseline_eu = self._profile_expected_utilities(profile_idx, decisions, decision_rules, agents, eu_cache)[agent]
+        agent_positions = [decisions.index(d) for d in agent_decs]
+        for agent_idx in itertools.product(*[range(len(decision_rules[d])) for d in agent_decs]):
+            deviation = list(profile_idx)
+            for pos, i in zip(agent_positions, agent_idx):
+                deviation[pos] = i
+            deviation_eu = self._profile_expected_utilities(tuple(deviation), decisions, decision_rules,
+                                                            agents, eu_cache)[agent]
+            if deviation_eu > baseline_eu:
+                return True
+        return False
+
+    def _profile_expected_utilities(self, profile_idx: Tuple[int, ...], decisions: List[str],
+                                    decision_rules: Dict[str, List[FunctionCPD]], agents: List[Union[str, int]],
+                                    eu_cache: Dict[Tuple[int, ...], Dict[Union[str, int], float]]
+                                    ) -> Dict[Union[str, int], float]:
+        """
+        Return every agent's expected utility under a joint pure strategy, memoized in eu_cache.
+        - The profile is imputed once for all the agents, rather than once for each agent.
+        """
+        if profile_idx not in eu_cache:
+            self._unsafe_replace_cpds(*[decision_rules[d][i] for d, i in zip(decisions, profile_idx)])
+            eu_cache[profile_idx] = {a: self.expected_utility({}, agent=a) for a in agents}
+        return eu_cache[profile_idx]
 
     def policy_profile_assignment(self, partial_policy: List[FunctionCPD]) -> Dict:
         """Return a dictionary with the joint or partial policy profile assigned -
@@ -85,16 +154,42 @@ class MACID(MACIDBase):
         - Each SPE comes as a list of FunctionCPDs, one for each decision node in the MACID.
         """
         spes: List[List[FunctionCPD]] = [[]]
+        # spe_choices[i][scc] is the index of the NE of scc chosen in spes[i]
+        spe_choices: List[Dict[int, int]] = [{}]
 
         # backwards induction over the sccs in the condensed relevance graph (handling tie-breaks)
-        for scc in reversed(CondensedRelevanceGraph(self).get_scc_topological_ordering()):
+        con_rel = CondensedRelevanceGraph(self)
+        decs_in_scc = con_rel.get_decisions_in_scc()
+        # a single scratch copy is shared by all the subgames. Only the decision nodes' CPDs are changed
+        # while solving a subgame, so these are restored before moving on to the next one.
+        scratch = self.copy()
+        solved_sccs: List[int] = []
+        for scc in reversed(list(nx.topological_sort(con_rel))):
+            # the NE of scc only depend on the partial profile restricted to the sccs it relies on, and to
+            # the solved sccs with a decision upstream of scc's decisions or their parents (these decide which
+            # decision contexts have probability zero, where any action is optimal). Compute them once for
+            # each such restriction.
+            family = set(decs_in_scc[scc]).union(*[scratch.get_parents(d) for d in decs_in_scc[scc]])
+            key_sccs = sorted(set(nx.descendants(con_rel, scc)).union(
+                s for s in solved_sccs if any(scratch._descendants(d) & family for d in decs_in_scc[s])))
+            solved_sccs.append(scc)
+            ne_cache: Dict[Tuple[int, ...], List[List[FunctionCPD]]] = {}
+            decision_cpds = [scratch.get_cpds(d) for d in scratch.all_decision_nodes]
+            # which decisions are irrelevant to the subgame doesn't depend on the partial profile
+            scratch._impute_random_to_irrelevant_decisions(decs_in_scc[scc])
             extended_spes = []
-            for partial_profile in spes:
-                self.add_cpds(*partial_profile)
-                all_ne_in_sg = self.get_all_pure_ne_in_sg(scc)
-                for ne in all_ne_in_sg:
+            extended_spe_choices = []
+            for partial_profile, choices in zip(spes, spe_choices):
+                key = tuple(choices[s] for s in key_sccs)
+                if key not in ne_cache:
+                    scratch.add_cpds(*partial_profile)
+                    ne_cache[key] = scratch._get_all_pure_ne_in_prepared_sg(decs_in_scc[scc])
+                for i, ne in enumerate(ne_cache[key]):
                     extended_spes.append(partial_profile + list(ne))
+                    extended_spe_choices.append({**choices, scc: i})
             spes = extended_spes
+            spe_choices = extended_spe_choices
+            scratch._unsafe_replace_cpds(*decision_cpds)
         return spes
 
     def decs_in_each_maid_subgame(self) -> List[set]:
@@ -102,17 +197,17 @@ class MACID(MACIDBase):
         Return a list giving the set of decision nodes in each MAID subgame of the original MAID.
         """
         con_rel = CondensedRelevanceGraph(self)
-        con_rel_sccs = con_rel.nodes  # the nodes of the condensed relevance graph are the maximal sccs of the MA(C)ID
-        powerset = list(itertools.chain.from_iterable(itertools.combinations(con_rel_sccs, r)
-                                                      for r in range(1, len(con_rel_sccs) + 1)))
-        con_rel_subgames = copy.deepcopy(powerset)
-        for subset in powerset:
-            for node in subset:
-                if not nx.descendants(con_rel, node).issubset(subset) and subset in con_rel_subgames:
-                    con_rel_subgames.remove(subset)
-
-        dec_subgames = [[con_rel.get_decisions_in_scc()[scc] for scc in con_rel_subgame]
-                        for con_rel_subgame in con_rel_subgames]
+        # a MAID subgame is a set of sccs that is closed under descendants in the condensed relevance graph.
+        # Build only these closed sets: visiting sccs from the sinks up, an scc can join any closed set
+        # that already contains all of its children.
+        closed_sets: List[Set[int]] = [set()]
+        for scc in reversed(list(nx.topological_sort(con_rel))):
+            children = set(con_rel.successors(scc))
+            closed_sets += [closed | {scc} for closed in closed_sets if children.issubset(closed)]
+        con_rel_subgames = sorted(closed_sets[1:], key=len)  # the first closed set is the empty one
+
+        decs_in_scc = con_rel.get_decisions_in_scc()
+        dec_subgames = [[decs_in_scc[scc] for scc in con_rel_subgame] for con_rel_subgame in con_rel_subgames]
 
         return [set(itertools.chain.from_iterable(i)) for i in dec_subgames]
 
@@ -122,13 +217,3 @@ class MACID(MACIDBase):
                      {agent: {'D': list(self.decision_nodes_agent[agent]),
                               'U': list(self.utility_nodes_agent[agent])}
                      for agent in self.agents})
-
-    def _get_color(self, node: str) -> Union[str, np.ndarray]:
-        """
-        Assign a unique colour with each new agent's decision and utility nodes
-        """
-        colors = cm.rainbow(np.linspace(0, 1, len(self.agents)))
-        if node in self.all_decision_nodes or node in self.all_utility_nodes:
-            return colors[[self.agents.index(self.whose_node[node])]]  # type: ignore
-        else:
-            return 'lightgray'  # chance node
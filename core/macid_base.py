@@ -2,20 +2,34 @@
 # agreements; and to You under the Apache License, Version 2.0.
 from __future__ import annotations
 
+import copy
 import random
-from functools import lru_cache
+from functools import lru_cache, reduce
+import operator
 import matplotlib.pyplot as plt
 import numpy as np
-from pgmpy.factors.discrete import TabularCPD  # type: ignore
+from pgmpy.factors.discrete import TabularCPD, DiscreteFactor  # type: ignore
 from pgmpy.models import BayesianModel  # type: ignore
-from typing import List, Tuple, Dict, Any, Callable, Union
-from pgmpy.inference.ExactInference import BeliefPropagation  # type: ignore
+from typing import List, Tuple, Dict, Any, Callable, Union, Set, Optional, Iterable, Iterator, FrozenSet
+from pgmpy.inference.ExactInference import VariableElimination  # type: ignore
 import networkx as nx
 from core.cpd import UniformRandomCPD, FunctionCPD, DecisionDomain
 import itertools
 import matplotlib.cm as cm
 from core.relevance_graph import RelevanceGraph
 
+try:
+    from math import prod
+except ImportError:  # Python 3.7
+    def prod(iterable: Iterable[int]) -> int:  # type: ignore
+        return reduce(operator.mul, iterable, 1)
+
+
+@lru_cache(maxsize=None)
+def _agent_colors(n_agents: int) -> np.ndarray:
+    """Return the palette used to colour each agent's nodes (shared by all (MA)CIDs with n_agents agents)"""
+    return cm.rainbow(np.linspace(0, 1, n_agents))  # type: ignore
+
 
 class MACIDBase(BayesianModel):
 
@@ -23,17 +37,32 @@ class MACIDBase(BayesianModel):
                  edges: List[Tuple[str, str]],
                  node_types: Dict[Union[str, int], Dict]):
         super().__init__(ebunch=edges)
-
-        self.decision_nodes_agent = {i: node_types[i]['D'] for i in node_types}
-        for node in self.all_decision_nodes:
+        self._init_node_types(node_types)
+        for node in self._decision_set:
             if node not in self.nodes:
                 raise Exception(f"Decision node {node} is not in the (MA)CID.")
-
-        self.utility_nodes_agent = {i: node_types[i]['U'] for i in node_types}
-        for node in self.all_utility_nodes:
+        for node in self._utility_set:
             if node not in self.nodes:
                 raise Exception(f"Utility node {node} is not in the (MA)CID.")
 
+    def _init_from_trusted(self,
+                           edges: Iterable[Tuple[str, str]],
+                           node_types: Dict[Union[str, int], Dict]) -> None:
+        """Initialize from edges known to form a DAG and node_types known to be consistent with them.
+
+        Skips pgmpy's per-edge cycle check and the node type validation of __init__."""
+        super().__init__()
+        nx.DiGraph.add_edges_from(self, edges)
+        self._init_node_types(node_types)
+
+    def _init_node_types(self, node_types: Dict[Union[str, int], Dict]) -> None:
+        self.decision_nodes_agent = {i: node_types[i]['D'] for i in node_types}
+        # sets of all the decision and utility nodes, for fast membership checks. Kept up to date by
+        # make_decision and make_chance
+        self._decision_set: Set[str] = set().union(*self.decision_nodes_agent.values())
+        self.utility_nodes_agent = {i: node_types[i]['U'] for i in node_types}
+        self._utility_set: Set[str] = set().union(*self.utility_nodes_agent.values())
+
         self.whose_node = {}
         for agent in self.agents:
             for node in self.decision_nodes_agent[agent]:
@@ -42,26 +71,54 @@ class MACIDBase(BayesianModel):
                 self.whose_node[node] = agent
 
         self.cpds_to_add: Dict[str, TabularCPD] = {}
+        # orderings of the nodes that only depend on the graph, cleared when nodes or edges change
+        self._topological_order_cache: Optional[List[str]] = None
+        self._elimination_order_cache: Optional[List[str]] = None
+        self._descendants_cache: Optional[Dict[str, FrozenSet[str]]] = None
+        self._utility_groups_cache: Dict[Tuple[Union[str, int], FrozenSet[str]], List[List[str]]] = {}
+        self._mechanism_graph_cache: Optional[MechanismGraph] = None
 
     @property
     def all_decision_nodes(self) -> List[str]:
-        return list(set().union(*list(self.decision_nodes_agent.values())))
+        return list(self._decision_set)
 
     @property
     def all_utility_nodes(self) -> List[str]:
-        return list(set().union(*list(self.utility_nodes_agent.values())))
+        return list(self._utility_set)
 
     @property
     def agents(self) -> List[Union[str, int]]:
         return list(self.decision_nodes_agent.keys())
 
+    def add_node(self, node: str, **kwargs: Any) -> None:
+        super().add_node(node, **kwargs)
+        self._clear_graph_caches()
+
+    def remove_node(self, node: str) -> None:
+        super().remove_node(node)
+        self._clear_graph_caches()
+
+    def _clear_graph_caches(self) -> None:
+        self._topological_order_cache = None
+        self._elimination_order_cache = None
+        self._descendants_cache = None
+        self._utility_groups_cache = {}
+        self._mechanism_graph_cache = None
+
     def remove_edge(self, u: str, v: str) -> None:
         super().remove_edge(u, v)
+        self._clear_graph_caches()
         if hasattr(self, "cpds") and isinstance(self.get_cpds(v), UniformRandomCPD):
             self.add_cpds(self.get_cpds(v))
 
+    def remove_edges_from(self, ebunch: Iterable[Tuple]) -> None:
+        for u, v, *_ in list(ebunch):
+            if self.has_edge(u, v):
+                self.remove_edge(u, v)
+
     def add_edge(self, u: str, v: str) -> None:
         super().add_edge(u, v)
+        self._clear_graph_caches()
         if hasattr(self, "cpds") and isinstance(self.get_cpds(v), UniformRandomCPD):
             self.add_cpds(self.get_cpds(v))
 
@@ -72,6 +129,7 @@ class MACIDBase(BayesianModel):
         elif hasattr(self, "cpds") and not isinstance(self.get_cpds(node), DecisionDomain):
             cpd_new = DecisionDomain(node, self.get_cpds(node).state_names[node])
             self.decision_nodes_agent[agent].append(node)
+            self._decision_set.add(node)
             self.whose_node[node] = agent
             self.add_cpds(cpd_new)
         else:
@@ -79,11 +137,12 @@ class MACIDBase(BayesianModel):
 
     def make_chance(self, node: str) -> None:
         """Turn a decision node into a chance node."""
-        if node in self.all_decision_nodes:
+        if node in self._decision_set:
             agent = self.whose_node[node]
             self.decision_nodes_agent[agent].remove(node)
+            self._decision_set.discard(node)
             self.whose_node.pop(node)
-        elif hasattr(self, "cpds") and node not in self.all_decision_nodes:
+        elif hasattr(self, "cpds") and node not in self._decision_set:
             pass
         elif not hasattr(self, "cpds"):
             raise Exception("The (MA)CID has not yet been parameterised")
@@ -97,7 +156,7 @@ class MACIDBase(BayesianModel):
         for cpd in cpds:
             assert cpd.variable in self.nodes
             assert isinstance(cpd, TabularCPD)
-            if isinstance(cpd, DecisionDomain) and cpd.variable not in self.all_decision_nodes:
+            if isinstance(cpd, DecisionDomain) and cpd.variable not in self._decision_set:
                 raise Exception(f"trying to add DecisionDomain to non-decision node {cpd.variable}")
             if isinstance(cpd, FunctionCPD) and set(cpd.evidence) != set(self.get_parents(cpd.variable)):
                 raise Exception(f"parents {cpd.evidence} of {cpd} " + f"don't match graph parents \
@@ -106,7 +165,7 @@ class MACIDBase(BayesianModel):
 
         # Initialize CPDs in topological order. Call super().add_cpds if initialized
         # successfully. Otherwise leave in self.cpds_to_add.
-        for var in nx.topological_sort(self):
+        for var in self._topological_order():
             if var in self.cpds_to_add:
                 cpd_to_add = self.cpds_to_add[var]
                 if hasattr(cpd_to_add, "initialize_tabular_cpd"):
@@ -115,30 +174,32 @@ class MACIDBase(BayesianModel):
                     # if the state_names have changed, remember to update all descendants:
                     previous_cpd = self.get_cpds(var)
                     if previous_cpd and previous_cpd.state_names[var] != cpd_to_add.state_names[var]:
-                        for descendant in nx.descendants(self, var):
+                        for descendant in self._descendants(var):
                             if descendant not in self.cpds_to_add and self.get_cpds(descendant):
                                 self.cpds_to_add[descendant] = self.get_cpds(descendant)
                     # add cpd to BayesianModel, and remove it from cpds_to_add
                     super().add_cpds(cpd_to_add)
                     del self.cpds_to_add[var]
 
+    def _unsafe_replace_cpds(self, *cpds: TabularCPD) -> None:
+        """
+        Swap in CPDs without the checks and (re-)initialization done by add_cpds.
+
+        Each cpd must already have been initialized for this (MA)CID, and must keep the state names
+        of the CPD it replaces, so that no descendants need to be re-initialized.
+        """
+        cpd_index = {cpd.variable: i for i, cpd in enumerate(self.cpds)}
+        for cpd in cpds:
+            self.cpds[cpd_index[cpd.variable]] = cpd
+
     def query(self, query: List[str], context: Dict[str, Any],
-              intervention: Dict["str", "Any"] = None) -> BeliefPropagation:
+              intervention: Dict["str", "Any"] = None) -> DiscreteFactor:
         """Return P(query|context, do(intervention))*P(context | do(intervention)).
 
         Use factor.normalize to get p(query|context, do(intervention)).
         Use context={} to get P(query). """
 
-        # Check that strategically relevant decisions have a policy specified
-        mech_graph = MechanismGraph(self)
-        for decision in self.all_decision_nodes:
-            for query_node in query:
-                if mech_graph.is_active_trail(decision + "mec", query_node, observed=list(context.keys())):
-                    cpd = self.get_cpds(decision)
-                    if not cpd:
-                        raise Exception(f"no DecisionDomain specified for {decision}")
-                    elif isinstance(cpd, DecisionDomain):
-                        raise Exception(f"query {query}|{context} depends on {decision}, but no policy imputed")
+        self._check_decision_policies(query, context)
 
         for variable, value in context.items():
             if value not in self.get_cpds(variable).state_names[variable]:
@@ -152,7 +213,7 @@ class MACIDBase(BayesianModel):
         #         cid.remove_node(node)
         # filtered_context = {k:v for k,v in context.items() if k in mm.nodes}
         if intervention:
-            cid = self.copy()
+            cid = self._copy_for_intervention(intervention)
             cid.intervene(intervention)
         else:
             cid = self
@@ -162,44 +223,110 @@ class MACIDBase(BayesianModel):
             cpd = cid.get_cpds(v)
             updated_state_names[v] = cpd.state_names[v]
 
-        bp = BeliefPropagation(cid)
         # TODO: check for probability 0 queries
-        # factor = bp.query(query, filtered_context)
 
-        # revise context so state_names are switched to their state number (overcomes pgmpy's bug)
-        revised_context = {variable: self.get_cpds(variable).name_to_no[variable][value]
-                           for variable, value in context.items()}
-        factor = bp.query(query, revised_context, show_progress=False)
-        factor.state_names = updated_state_names  # factor sometimes gets state_names wrong...
+        # revise context so state_names are switched to their state number (overcomes pgmpy's bug).
+        # An intervention may have shrunk a variable's domain, so the numbers are taken from the cid
+        name_to_no = {variable: cid.get_cpds(variable).name_to_no[variable] for variable in context}
+        revised_context = {variable: name_to_no[variable][value]
+                           for variable, value in context.items() if value in name_to_no[variable]}
+        # pgmpy fails to reduce CPDs that lack the state names of their parents, so the context is
+        # included in the query and the joint distribution is then restricted to the context.
+        # An intervention doesn't change the graph, so the cid can use this (MA)CID's elimination order.
+        joint_variables = query + [variable for variable in context if variable not in query]
+        elimination_order = [node for node in self._elimination_order() if node not in joint_variables]
+        joint = VariableElimination(cid).query(joint_variables, elimination_order=elimination_order,
+                                               show_progress=False)
+        context_slice = tuple(revised_context.get(variable, 0) if variable in context else slice(None)
+                              for variable in joint.variables)
+        variables = [variable for variable in joint.variables if variable not in context]
+        values = joint.values[context_slice]
+        if len(revised_context) < len(context):  # the context is impossible under the intervention
+            values = np.zeros_like(values)
+        factor = DiscreteFactor(variables, [joint.get_cardinality([v])[v] for v in variables],
+                                values, state_names=updated_state_names)
         return factor
 
+    def _check_decision_policies(self, query: List[str], context: Dict[str, Any]) -> None:
+        """Check that the decisions the query depends on (given the context) have a policy specified
+
+        Only the decisions without a policy need checking, against the mechanisms found in one traversal
+        from the query nodes."""
+        unset_decisions = [decision for decision in self.all_decision_nodes
+                           if not self.get_cpds(decision) or isinstance(self.get_cpds(decision), DecisionDomain)]
+        if unset_decisions:
+            active_nodes = set().union(
+                *self._mechanism_graph().active_trail_nodes(query, observed=list(context.keys())).values())
+            for decision in unset_decisions:
+                if decision + "mec" in active_nodes:
+                    if not self.get_cpds(decision):
+                        raise Exception(f"no DecisionDomain specified for {decision}")
+                    else:
+                        raise Exception(f"query {query}|{context} depends on {decision}, but no policy imputed")
+
+    def _elimination_order(self) -> List[str]:
+        """
+        Return a min-fill elimination order of all the nodes, to be shared by queries.
+        - The order only depends on the graph, so it is computed once and recomputed only after
+        nodes or edges have been added or removed.
+        - Nodes are greedily eliminated from the moral graph, each time picking a node whose
+        neighbours need the fewest extra edges to become a clique.
+        """
+        if self._elimination_order_cache is None:
+            moral_graph = nx.Graph(self.moralize())
+            elimination_order = []
+            while moral_graph:
+                node = min(moral_graph, key=lambda n: sum(not moral_graph.has_edge(u, v)
+                                                          for u, v in itertools.combinations(moral_graph[n], 2)))
+                moral_graph.add_edges_from(list(itertools.combinations(moral_graph[node], 2)))
+                moral_graph.remove_node(node)
+                elimination_order.append(node)
+            self._elimination_order_cache = elimination_order
+        return list(self._elimination_order_cache)
+
+    def _copy_for_intervention(self, intervention: Dict["str", "Any"]) -> MACIDBase:
+        """
+        Return a copy that the intervention can be applied to without affecting this (MA)CID.
+        - Intervening only replaces CPDs, so the copy shares the graph and the node types with this
+        (MA)CID, and must not have its structure edited.
+        - Only the CPDs of the intervened nodes and their descendants are copied, since these are the
+        only ones that add_cpds may re-initialize. The other CPDs are shared.
+        """
+        cid = copy.copy(self)
+        affected = set(intervention).union(*[self._descendants(v) for v in intervention])
+        cid.cpds = [cpd for cpd in self.cpds if cpd.variable not in affected]
+        cid.cpds_to_add = {}
+        cid.add_cpds(*[cpd.copy() for cpd in self.cpds if cpd.variable in affected])
+        return cid
+
     def intervene(self, intervention: Dict["str", "Any"]) -> None:
         """Given a dictionary of interventions, replace the CPDs for the relevant nodes.
 
         Soft interventions can be achieved by using add_cpds directly.
         """
         for variable, value in intervention.items():
-            cpd = FunctionCPD(variable, lambda *x: value, evidence=self.get_parents(variable))
+            cpd = FunctionCPD(variable, lambda *x, value=value: value, evidence=self.get_parents(variable))
             self.add_cpds(cpd)
 
     def expected_value(self, variables: List[str], context: Dict["str", "Any"],
                        intervene: Dict["str", "Any"] = None,) -> List[float]:
         """Compute the expected value of a real-valued variable for a given context,
         under an optional intervention
+
+        The expected values are returned in the same order as variables.
         """
         factor = self.query(variables, context, intervention=intervene)
         factor.normalize()  # make probs add to one
 
-        ev = np.array([0.0 for _ in factor.variables])
-        for idx, prob in np.ndenumerate(factor.values):
-            # idx contains the information about the value each variable takes
-            # we use state_names to convert index into the actual value of the variable
-            ev += prob * np.array([factor.state_names[variable][idx[var_idx]]
-                                   for var_idx, variable in enumerate(factor.variables)])
-            if np.isnan(ev).any():
-                raise Exception("query {} | {} generated Nan from idx: {}, prob: {}, \
-                                consider imputing a random decision".format(variables, context, idx, prob))
-        return ev.tolist()  # type: ignore
+        # the expectation of each variable is its state values weighted by its marginal probabilities
+        ev = np.array([np.tensordot(factor.values, np.asarray(factor.state_names[variable], dtype=float),
+                                    axes=([var_idx], [0])).sum()
+                       for var_idx, variable in enumerate(factor.variables)])
+        if np.isnan(ev).any():
+            raise Exception("query {} | {} generated Nan, consider imputing a random decision".format(
+                variables, context))
+        # the factor may order its variables differently from the query
+        return [ev[factor.variables.index(variable)] for variable in variables]
 
     def expected_utility(self, context: Dict["str", "Any"],
                          intervene: Dict["str", "Any"] = None, agent: Union[str, int] = 0) -> float:
@@ -208,14 +335,50 @@ class MACIDBase(BayesianModel):
         For example:
         cid = get_minimal_cid()
         out = self.expected_utility({'D':1}) #TODO: give example that uses context
+
+        Utility nodes that are d-separated given the context are queried separately, so that no
+        query has to build a joint distribution over them.
+        """
+        if intervene:
+            # check the policies before the intervention, like query does
+            self._check_decision_policies(self.utility_nodes_agent[agent], context)
+            cid = self._copy_for_intervention(intervene)
+            cid.intervene(intervene)
+        else:
+            cid = self
+        return sum(sum(cid.expected_value(utilities, context))
+                   for utilities in self._d_separated_utilities(agent, list(context)))
+
+    def _d_separated_utilities(self, agent: Union[str, int], observed: List[str]) -> List[List[str]]:
         """
-        return sum(self.expected_value(self.utility_nodes_agent[agent], context, intervene=intervene))
+        Split the agent's utility nodes into groups that are d-separated from each other given observed.
+        - Two groups are d-separated iff they are disconnected in the moral graph of their ancestral
+        graph (including observed) once the observed nodes are removed.
+        - The groups only depend on the graph, so they are cached for each agent and set of observed nodes.
+        """
+        key = (agent, frozenset(observed))
+        if key not in self._utility_groups_cache:
+            utilities = self.utility_nodes_agent[agent]
+            targets = set(utilities).union(observed)
+            ancestral_nodes = targets.union(n for n in self.nodes if not self._descendants(n).isdisjoint(targets))
+            moral_graph = nx.Graph()
+            moral_graph.add_nodes_from(ancestral_nodes)
+            for node in ancestral_nodes:
+                parents = self.get_parents(node)
+                moral_graph.add_edges_from((parent, node) for parent in parents)
+                moral_graph.add_edges_from(itertools.combinations(parents, 2))
+            moral_graph.remove_nodes_from(observed)
+            groups = [[u for u in utilities if u in component] for component in nx.connected_components(moral_graph)]
+            self._utility_groups_cache[key] = [group for group in groups if group]
+        return self._utility_groups_cache[key]
 
     def get_valid_order(self, nodes: List[str] = None) -> List[str]:
         """Get a topological order of the specified set of nodes (this may not be unique).
 
         By default, a topological ordering of the decision nodes is given"""
-        if not nx.is_directed_acyclic_graph(self):
+        try:
+            topological_order = self._topological_order()
+        except nx.NetworkXUnfeasible:
             raise Exception("A topological ordering of nodes can only be returned if the (MA)CID is acyclic")
 
         if nodes:
@@ -223,11 +386,42 @@ class MACIDBase(BayesianModel):
                 if node not in self.nodes:
                     raise Exception(f"{node} is not in the (MA)CID.")
 
-        if not nodes:
-            nodes = self.all_decision_nodes
-        srt = [i for i in nx.topological_sort(self) if i in nodes]
+        nodes_set = set(nodes) if nodes else self._decision_set
+        srt = [i for i in topological_order if i in nodes_set]
         return srt
 
+    def _topological_order(self) -> List[str]:
+        """
+        Return a topological order of all the nodes.
+        - The order is computed once and recomputed only after nodes or edges have been added or removed.
+        """
+        if self._topological_order_cache is None:
+            self._topological_order_cache = list(nx.topological_sort(self))
+        return list(self._topological_order_cache)
+
+    def _mechanism_graph(self) -> MechanismGraph:
+        """
+        Return the mechanism graph of the (MA)CID, for d-separation queries only.
+        - The graph is built once and rebuilt only after nodes or edges have been added or removed.
+        """
+        if self._mechanism_graph_cache is None:
+            self._mechanism_graph_cache = MechanismGraph(self)
+        return self._mechanism_graph_cache
+
+    def _descendants(self, node: str) -> FrozenSet[str]:
+        """
+        Return the descendants of the given node.
+        - The descendants of all the nodes are found together, in one pass up a topological order,
+        and recomputed only after nodes or edges have been added or removed.
+        """
+        if self._descendants_cache is None:
+            descendants: Dict[str, FrozenSet[str]] = {}
+            for n in reversed(self._topological_order()):
+                children = self.get_children(n)
+                descendants[n] = frozenset(children).union(*[descendants[c] for c in children])
+            self._descendants_cache = descendants
+        return self._descendants_cache[node]
+
     def is_s_reachable(self, d1: Union[str, List[str]], d2: Union[str, List[str]]) -> bool:
         """
         Determine whether 'D2' is s-reachable from 'D1' (Koller and Milch, 2001)
@@ -237,7 +431,7 @@ class MACIDBase(BayesianModel):
         D2′ to U given Pa(D)∪{D}, where a path is active in a MAID if it is active in the same graph, viewed as a BN.
 
         """
-        assert d2 in self.all_decision_nodes
+        assert d2 in self._decision_set
         return self.is_r_reachable(d1, d2)
 
     def is_r_reachable(self, decisions: Union[str, List[str]], nodes: Union[str, List[str]]) -> bool:
@@ -251,16 +445,42 @@ class MACIDBase(BayesianModel):
             decisions = [decisions]
         if isinstance(nodes, str):
             nodes = [nodes]
-        mg = MechanismGraph(self)
+        mg = self._mechanism_graph()
+        mechanisms = [node + "mec" for node in nodes]
         for decision in decisions:
-            for node in nodes:
-                con_nodes = [decision] + self.get_parents(decision)
-                agent_utilities = self.utility_nodes_agent[self.whose_node[decision]]
-                for utility in set(agent_utilities).intersection(nx.descendants(self, decision)):
-                    if mg.is_active_trail(node + "mec", utility, con_nodes):
-                        return True
+            active_nodes = self._active_nodes_from_utilities(mg, decision)
+            if any(mechanism in active_nodes for mechanism in mechanisms):
+                return True
         return False
 
+    def _get_r_reachable_nodes(self, decisions: List[str]) -> Dict[str, Set[str]]:
+        """
+        Return a dictionary matching each decision with the set of nodes that are r-reachable from it.
+        - A single mechanism graph is shared by all the decisions, and the active trails from
+        each decision's descendant utility nodes are found in one traversal per utility node
+        (d-connection is symmetric), rather than once per (node, utility node) pair.
+        """
+        mg = self._mechanism_graph()
+        r_reachable_nodes: Dict[str, Set[str]] = {}
+        for decision in decisions:
+            active_nodes = self._active_nodes_from_utilities(mg, decision)
+            r_reachable_nodes[decision] = {node for node in self.nodes if node + "mec" in active_nodes}
+        return r_reachable_nodes
+
+    def _active_nodes_from_utilities(self, mg: MechanismGraph, decision: str) -> Set[str]:
+        """
+        Return the nodes of the mechanism graph mg that have an active trail to one of decision's
+        descendant utility nodes, given the decision and its parents.
+        - A node V is r-reachable from decision iff V's mechanism node is among them.
+        - One traversal from the utility nodes covers every node's mechanism (d-connection is symmetric).
+        """
+        con_nodes = [decision] + self.get_parents(decision)
+        agent_utilities = self.utility_nodes_agent[self.whose_node[decision]]
+        descended_utilities = list(self._descendants(decision).intersection(agent_utilities))
+        if not descended_utilities:
+            return set()
+        return set().union(*mg.active_trail_nodes(descended_utilities, observed=con_nodes).values())
+
     def sufficient_recall(self, agent: Union[str, int] = None) -> bool:
         """
         Finds whether a (MA)CID has sufficient recall.
@@ -294,16 +514,15 @@ class MACIDBase(BayesianModel):
 
         # We begin by representing each possible decision as a list values, with length
         # equal the number of decision contexts
-        functions_as_lists = list(itertools.product(state_names, repeat=np.product(evidence_card)))
+        functions_as_lists = list(itertools.product(state_names, repeat=prod(map(int, evidence_card))))
+
+        # the state numbers and strides of the parents are shared by all the decision rules
+        name_to_no: List[Dict[Any, int]] = [self.get_cpds(p).name_to_no[p] for p in parents]
+        strides = [prod(map(int, evidence_card[:i])) for i in range(len(parents))]
 
         def arg2idx(parent_values: tuple) -> int:
             """Convert a decision context into an index for the function list"""
-            idx = 0
-            for i, pv in enumerate(parent_values):
-                name_to_no: Dict[Any, int] = self.get_cpds(parents[i]).name_to_no[parents[i]]
-                idx += name_to_no[pv] * np.product(evidence_card[:i])
-            assert 0 <= idx <= len(functions_as_lists)
-            return idx
+            return sum(name_to_no[i][pv] * strides[i] for i, pv in enumerate(parent_values))
 
         function_cpds: List[FunctionCPD] = []
         for func_list in functions_as_lists:
@@ -312,32 +531,87 @@ class MACIDBase(BayesianModel):
             function_cpds.append(FunctionCPD(decision, function, cpd.variables[1:], state_names=cpd.state_names))
         return function_cpds
 
-    def pure_strategies(self, decision_nodes: List[str]) -> List[List[FunctionCPD]]:
+    def pure_strategies(self, decision_nodes: List[str]) -> Iterator[Tuple[FunctionCPD, ...]]:
         """
         Find all of an agent's pure policies in this subgame.
+        - The policies are generated lazily, so the full product is never held in memory.
         """
         possible_dec_rules = list(map(self.pure_decision_rules, decision_nodes))
-        return list(itertools.product(*possible_dec_rules))
+        return itertools.product(*possible_dec_rules)
 
     def optimal_pure_strategies(self, decisions: List[str]) -> List[List[FunctionCPD]]:
         """
         Return a list of all optimal strategies for a given set of decisions
+        - For a single decision, the optimal decision rules are found one decision context at a time.
+        Otherwise, every pure strategy is evaluated.
         """
         if not decisions:
             return []
         agent = self.whose_node[decisions[0]]
         assert set(decisions).issubset(self.decision_nodes_agent[agent])
+        if len(decisions) == 1:
+            return [[decision_rule] for decision_rule in self._optimal_decision_rules(decisions[0])]
         macid = self.copy()
-        for d in macid.all_decision_nodes:
-            if not macid.is_s_reachable(decisions, d) and isinstance(macid.get_cpds(d), DecisionDomain):
-                macid.impute_random_decision(d)
-        expected_utility: List[float] = []
-        strategies = macid.pure_strategies(decisions)
-        for strategy in strategies:
+        macid._impute_random_to_irrelevant_decisions(decisions)
+        max_eu = float('-inf')
+        optimal_strategies: List[List[FunctionCPD]] = []
+        for strategy in macid.pure_strategies(decisions):
             macid.add_cpds(*strategy)
-            expected_utility.append(macid.expected_utility({}, agent=agent))
-        return [strategy for i, strategy in enumerate(strategies)
-                if expected_utility[i] == max(expected_utility)]
+            eu = macid.expected_utility({}, agent=agent)
+            if eu > max_eu:
+                max_eu = eu
+                optimal_strategies = []
+            if eu == max_eu:
+                optimal_strategies.append(list(strategy))
+        return optimal_strategies
+
+    def _optimal_decision_rules(self, decision: str) -> List[FunctionCPD]:
+        """
+        Return a list of all optimal decision rules for a given decision, without enumerating them all.
+        - The parents of the decision are not affected by its decision rule, so a decision rule is optimal
+        iff it picks an action maximising the expected utility in every decision context that has
+        positive probability. Any action is optimal in a context with probability zero.
+        - Only the decision's descendant utility nodes depend on the decision rule.
+        """
+        cpd = self.get_cpds(decision)
+        parents = cpd.variables[1:]
+        state_names = cpd.state_names[decision]
+        agent_utilities = self.utility_nodes_agent[self.whose_node[decision]]
+        descended_utilities = list(self._descendants(decision).intersection(agent_utilities))
+        macid = self.copy()
+        macid._impute_random_to_irrelevant_decisions([decision])
+        macid.impute_random_decision(decision)
+
+        # the expected utility of every (decision context, action) pair, with axes ordered as parents + [decision],
+        # read from one query per utility node rather than one query per pair
+        parent_values = [self.get_cpds(p).state_names[p] for p in parents]
+        table_shape = tuple(len(values) for values in parent_values) + (len(state_names),)
+        context_probs = np.ones(table_shape[:-1])
+        eu_table = np.zeros(table_shape)
+        for utility in descended_utilities:
+            factor = macid.query([utility] + parents + [decision], {})
+            values = factor.values.transpose([factor.variables.index(v) for v in [utility] + parents + [decision]])
+            context_probs = values.sum(axis=(0, values.ndim - 1))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                utility_probs = values / values.sum(axis=0)
+            eu_table += np.tensordot(np.asarray(factor.state_names[utility], dtype=float), utility_probs, axes=1)
+
+        decision_contexts = []
+        optimal_actions = []
+        for idx in np.ndindex(*context_probs.shape):
+            decision_contexts.append(tuple(parent_values[i][j] for i, j in enumerate(idx)))
+            if context_probs[idx] == 0 or not descended_utilities:
+                optimal_actions.append(state_names)
+                continue
+            eu = eu_table[idx]
+            optimal_actions.append([d for i, d in enumerate(state_names) if eu[i] == eu.max()])
+
+        function_cpds: List[FunctionCPD] = []
+        for actions in itertools.product(*optimal_actions):
+            def function(*parent_values: tuple, policy: Dict = dict(zip(decision_contexts, actions))) -> Any:
+                return policy[parent_values]
+            function_cpds.append(FunctionCPD(decision, function, parents, state_names=cpd.state_names))
+        return function_cpds
 
     def optimal_pure_decision_rules(self, decision: str) -> List[FunctionCPD]:
         """
@@ -354,6 +628,14 @@ class MACIDBase(BayesianModel):
             raise Exception(f"can't figure out domain for {d}, did you forget to specify DecisionDomain?")
         self.add_cpds(UniformRandomCPD(d, sn))
 
+    def _impute_random_to_irrelevant_decisions(self, decisions: List[str]) -> None:
+        """Impute a random policy to each non-instantiated decision node that isn't s-reachable from decisions"""
+        r_reachable_nodes = self._get_r_reachable_nodes(decisions)
+        relevant_nodes = set().union(*r_reachable_nodes.values())
+        for d in self.all_decision_nodes:
+            if d not in relevant_nodes and isinstance(self.get_cpds(d), DecisionDomain):
+                self.impute_random_decision(d)
+
     def impute_fully_mixed_policy_profile(self) -> None:
         """Impute a fully mixed policy profile - ie a random decision rule to all decision nodes"""
         for d in self.all_decision_nodes:
@@ -388,10 +670,23 @@ class MACIDBase(BayesianModel):
         parents = self.get_parents(d)
         new = self.copy()
 
-        @lru_cache(maxsize=1000)
+        # tabulate E[y | parents] from a single query of the joint distribution of y and the parents
+        factor = new.query([y] + parents, {})
+        y_axis = factor.variables.index(y)
+        y_values = np.asarray(factor.state_names[y], dtype=float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cond_exp = np.tensordot(factor.values, y_values, axes=([y_axis], [0])) / factor.values.sum(axis=y_axis)
+        table_parents = [v for v in factor.variables if v != y]
+        cond_exp_table: Dict[tuple, float] = {}
+        for idx in np.ndindex(*cond_exp.shape):
+            pv = {p: factor.state_names[p][i] for p, i in zip(table_parents, idx)}
+            cond_exp_table[tuple(pv[p] for p in parents)] = cond_exp[idx]
+
         def cond_exp_policy(*pv: tuple) -> float:
-            context = {p: pv[i] for i, p in enumerate(parents)}
-            return new.expected_value([y], context)[0]
+            if np.isnan(cond_exp_table[pv]):
+                raise Exception("query {} | {} generated Nan, consider imputing a random decision".format(
+                    [y], dict(zip(parents, pv))))
+            return cond_exp_table[pv]
 
         self.add_cpds(FunctionCPD(d, cond_exp_policy, parents, label="cond_exp({})".format(y)))
 
@@ -405,7 +700,19 @@ class MACIDBase(BayesianModel):
     def copy(self) -> MACIDBase:
         """copy the MACIDBase object"""
         model_copy = self.copy_without_cpds()
-        if self.cpds:
+        if model_copy.nodes == self.nodes:
+            # the cached orderings and descendants are never modified in place, so the copy can share them
+            model_copy._topological_order_cache = self._topological_order_cache
+            model_copy._elimination_order_cache = self._elimination_order_cache
+            model_copy._descendants_cache = self._descendants_cache
+            model_copy._mechanism_graph_cache = self._mechanism_graph_cache
+            # the initialized FunctionCPDs and UniformRandomCPDs are still valid for the same graph. Their
+            # tables are only ever replaced by re-initialization, never modified in place, so shallow copies
+            # can be added without re-initializing them. Plain TabularCPDs are copied in full.
+            super(MACIDBase, model_copy).add_cpds(
+                *[copy.copy(cpd) if isinstance(cpd, (FunctionCPD, UniformRandomCPD)) else cpd.copy()
+                  for cpd in self.cpds])
+        elif self.cpds:
             model_copy.add_cpds(*[cpd.copy() for cpd in self.cpds])
         return model_copy
 
@@ -413,16 +720,16 @@ class MACIDBase(BayesianModel):
         """
         Assign a unique colour to each new agent's decision and utility nodes
         """
-        colors = cm.rainbow(np.linspace(0, 1, len(self.agents)))
-        if node in self.all_decision_nodes or node in self.all_utility_nodes:
-            return colors[[self.agents.index(self.whose_node[node])]]  # type: ignore
+        if node in self.whose_node:  # decision and utility nodes
+            agents = self.agents
+            return _agent_colors(len(agents))[[agents.index(self.whose_node[node])]]
         else:
             return 'lightgray'  # chance node
 
     def _get_shape(self, node: str) -> str:
-        if node in self.all_decision_nodes:
+        if node in self._decision_set:
             return 's'
-        elif node in self.all_utility_nodes:
+        elif node in self._utility_set:
             return 'D'
         else:
             return 'o'
@@ -478,13 +785,13 @@ class MechanismGraph(MACIDBase):
     """A mechanism graph has an extra parent node+"mec" for each node"""
 
     def __init__(self, cid: MACIDBase):
-        super().__init__(cid.edges(),
-                         {agent: {'D': list(cid.decision_nodes_agent[agent]),
-                                  'U': list(cid.utility_nodes_agent[agent])}
-                          for agent in cid.agents})
         for node in cid.nodes:
             if node[:-3] == "mec":
                 raise Exception("can't create a mechanism graph when node {node} already ends with mec")
-            self.add_node(node + "mec")
-            self.add_edge(node + "mec", node)
+        # the structure is taken from cid, and the mechanism nodes have no parents, so no validation is needed
+        mechanism_edges = [(node + "mec", node) for node in cid.nodes]
+        self._init_from_trusted(itertools.chain(cid.edges(), mechanism_edges),
+                                {agent: {'D': list(cid.decision_nodes_agent[agent]),
+                                         'U': list(cid.utility_nodes_agent[agent])}
+                                 for agent in cid.agents})
         # TODO: adapt the parameterization from cid as well
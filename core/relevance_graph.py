@@ -1,5 +1,4 @@
 from __future__ import annotations
-import itertools
 from typing import List, Any, Dict
 import numpy as np
 import matplotlib.cm as cm
@@ -24,10 +23,11 @@ class RelevanceGraph(nx.DiGraph):
         if decisions is None:
             decisions = cid.all_decision_nodes
         self.add_nodes_from(decisions)
-        dec_pair_perms = list(itertools.permutations(decisions, 2))
-        for dec_pair in dec_pair_perms:
-            if cid.is_s_reachable(dec_pair[0], dec_pair[1]):
-                self.add_edge(dec_pair[0], dec_pair[1])
+        r_reachable_nodes = cid._get_r_reachable_nodes(decisions)
+        for d1 in decisions:
+            for d2 in decisions:
+                if d2 != d1 and d2 in r_reachable_nodes[d1]:  # ie d2 is s-reachable from d1
+                    self.add_edge(d1, d2)
 
     def is_acyclic(self) -> bool:
         """
@@ -103,7 +103,8 @@ class CondensedRelevanceGraph(nx.DiGraph):
         Return a topological ordering (which might not be unique) of the SCCs as
         a list of decision nodes in each SCC.
         """
-        decs_in_each_scc = [self.get_decisions_in_scc()[scc] for scc in list(nx.topological_sort(self))]
+        decs_in_scc = self.get_decisions_in_scc()
+        decs_in_each_scc = [decs_in_scc[scc] for scc in nx.topological_sort(self)]
         return decs_in_each_scc
 
     def get_decisions_in_scc(self) -> Dict[int, List[str]]:
@@ -111,5 +112,5 @@ class CondensedRelevanceGraph(nx.DiGraph):
         scc_dec_mapping: Dict[int, List[str]] = {}
         # invert the dictionary to match each scc with the decision nodes in it
         for k, v in self.graph['mapping'].items():
-            scc_dec_mapping[v] = scc_dec_mapping.get(v, []) + [k]
+            scc_dec_mapping.setdefault(v, []).append(k)
         return scc_dec_mapping
@@ -38,6 +38,24 @@ class TestCPD(unittest.TestCase):
         self.assertEqual(cpd_a.get_cardinality(['A'])['A'], 1)
         self.assertEqual(cpd_a.get_state_names('A', 0), 2)
 
+    def test_function_cpd_evidence_order(self) -> None:
+        cid = get_introduced_bias()
+        self.assertEqual(cid.get_parents('Y'), ['Z', 'X'])
+        cid.add_cpds(FunctionCPD('Y', lambda x, z: x, evidence=['X', 'Z']))
+        self.assertEqual(cid.expected_value(['Y'], {'X': 0, 'Z': 1}), [0])
+
+    def test_function_cpd_signature(self) -> None:
+        cid = get_minimal_cid()
+        cpd_a = FunctionCPD('A', lambda: 2, evidence=[])
+        cpd_b = FunctionCPD('B', lambda a: a, evidence=['A'])
+        cpd_b2 = FunctionCPD('B', lambda a: 2 * a - 2, evidence=['A'])  # same table given A = 2
+        with self.assertRaises(Exception):
+            cpd_b.signature()
+        cid.add_cpds(cpd_a, cpd_b)
+        cpd_b2.initialize_tabular_cpd(cid)
+        self.assertEqual(cpd_b.signature(), cpd_b2.signature())
+        self.assertNotEqual(cpd_a.signature(), cpd_b.signature())
+
     def test_updated_decision_names(self) -> None:
         cid = get_introduced_bias()
         self.assertEqual(cid.get_cpds('D').state_names['D'], [0, 1])
@@ -8,10 +8,12 @@ sys.path.insert(0, os.path.abspath('.'))
 sys.path.insert(0, os.path.abspath('../'))
 import unittest
 from examples.simple_macids import basic_different_dec_cardinality, get_basic_subgames, \
-    get_basic_subgames3, two_agents_three_actions
+    get_basic_subgames3, two_agents_three_actions, basic2agent_tie_break
 from examples.story_macids import battle_of_the_sexes, matching_pennies, taxi_competition, \
     modified_taxi_competition, prisoners_dilemma
 import numpy as np
+from core.macid import MACID
+from core.cpd import DecisionDomain, FunctionCPD
 
 
 class TestMACID(unittest.TestCase):
@@ -65,6 +67,9 @@ class TestMACID(unittest.TestCase):
         macid4 = two_agents_three_actions()
         self.assertEqual(len(macid4.get_all_pure_ne()), 1)
 
+        macid5 = basic2agent_tie_break()
+        self.assertEqual(len(macid5.get_all_pure_ne()), 3)
+
     # @unittest.skip("")
     def test_get_all_pure_ne_in_sg(self) -> None:
         macid = taxi_competition()
@@ -111,6 +116,17 @@ class TestMACID(unittest.TestCase):
         self.assertTrue(np.array_equal(cpd_d1.values, np.array([0, 1])))
         self.assertTrue(np.array_equal(cpd_d2.values, np.array([[0, 0], [1, 0], [0, 1]])))
 
+        # D1 isn't relied on by D2, but decides which of D2's decision contexts have probability zero
+        macid = MACID([('D1', 'X'), ('X', 'D2'), ('D2', 'U2'), ('X', 'U2'), ('D1', 'U1')],
+                      {1: {'D': ['D1'], 'U': ['U1']}, 2: {'D': ['D2'], 'U': ['U2']}})
+        macid.add_cpds(DecisionDomain('D1', [0, 1]), DecisionDomain('D2', [0, 1]),
+                       FunctionCPD('X', lambda d1: d1, evidence=['D1']),
+                       FunctionCPD('U1', lambda d1: 0, evidence=['D1']),
+                       FunctionCPD('U2', lambda x, d2: int(x == d2), evidence=['X', 'D2']))
+        for spe in macid.get_all_pure_spe():
+            macid.add_cpds(*spe)
+            self.assertEqual(macid.expected_utility({}, agent=2), 1)
+
 
 if __name__ == "__main__":
     suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestMACID)
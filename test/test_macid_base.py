@@ -14,6 +14,8 @@ from examples.story_macids import prisoners_dilemma, taxi_competition
 from pgmpy.factors.discrete import TabularCPD  # type: ignore
 from examples.story_macids import forgetful_movie_star, subgame_difference
 from core.macid_base import MechanismGraph
+from core.cid import CID
+from core.cpd import UniformRandomCPD, DecisionDomain, FunctionCPD
 
 
 class TestBASE(unittest.TestCase):
@@ -28,6 +30,8 @@ class TestBASE(unittest.TestCase):
         self.assertTrue(cid.check_model())
         cid.add_edge('S', 'D')
         self.assertTrue(cid.check_model())
+        cid.remove_edges_from([('S', 'D')])
+        self.assertTrue(cid.check_model())
 
     def test_make_decision(self) -> None:
         cid = get_3node_cid()
@@ -79,6 +83,9 @@ class TestBASE(unittest.TestCase):
         self.assertEqual(eu000, 2)
         eu001 = five_node.expected_utility({'D': 0, 'S1': 0, 'S2': 1})
         self.assertEqual(eu001, 1)
+        # the utilities are only queried separately once they are d-separated by the context
+        self.assertEqual(sorted(five_node._d_separated_utilities(0, ['D', 'S1', 'S2'])), [['U1'], ['U2']])
+        self.assertEqual(len(five_node._d_separated_utilities(0, ['D'])), 1)
         macid_example = prisoners_dilemma()
         eu_agent0 = macid_example.expected_utility({'D1': 'd', 'D2': 'c'}, agent=1)
         self.assertEqual(eu_agent0, 0)
@@ -106,8 +113,27 @@ class TestBASE(unittest.TestCase):
         self.assertEqual(cid.expected_value(['B'], {}, intervene={'A': 1})[0], 1)
         macid = taxi_competition()
         macid.impute_fully_mixed_policy_profile()
+        eu_before = macid.expected_value(['U1', 'U2'], {})
         self.assertEqual(macid.expected_value(['U1'], {}, intervene={'D1': 'c', 'D2': 'e'})[0], 3)
+        self.assertEqual(macid.expected_value(['U1', 'U2'], {}), eu_before)  # the intervention is not kept
         self.assertEqual(macid.expected_value(['U2'], {}, intervene={'D1': 'c', 'D2': 'e'})[0], 5)
+        self.assertEqual(macid.expected_value(['U2', 'U1'], {}, intervene={'D1': 'c', 'D2': 'e'}), [5, 3])
+        # the context is read in the intervened domain, where contradicting values have probability 0
+        cid = get_3node_cid()
+        cid.impute_random_policy()
+        self.assertEqual(cid.expected_value(['U'], {'D': 1}, intervene={'D': 1}), [0])
+        self.assertTrue(np.all(cid.query(['U'], {'D': -1}, intervention={'D': 1}).values == 0))
+        # the policies are checked before intervening, by both entry points
+        cid = get_3node_cid()
+        with self.assertRaises(Exception):
+            cid.expected_value(['U'], {}, intervene={'D': 1})
+        with self.assertRaises(Exception):
+            cid.expected_utility({}, intervene={'D': 1})
+        cid.impute_random_policy()
+        # each intervened node keeps its own value when it is re-initialized
+        cid.intervene({'D': 1, 'S': -1})
+        cid.add_cpds(UniformRandomCPD('S', [-1, 1, 3]))
+        self.assertEqual(cid.get_cpds('D').state_names['D'], [1])
 
     # @unittest.skip("")
     def test_possible_pure_decision_rules(self) -> None:
@@ -168,6 +194,26 @@ class TestBASE(unittest.TestCase):
             five_node.add_cpds(cpd)
             self.assertEqual(five_node.expected_utility({}), 1.5)
 
+        # the optimal decision rules are exactly the pure decision rules with maximal expected utility
+        five_node = get_5node_cid()
+        five_node.impute_random_decision('D')
+        expected_utilities = []
+        for decision_rule in five_node.pure_decision_rules('D'):
+            five_node.add_cpds(decision_rule)
+            expected_utilities.append((decision_rule, five_node.expected_utility({})))
+        max_eu = max(eu for _, eu in expected_utilities)
+        optimal_decision_rules = five_node.optimal_pure_decision_rules('D')
+        for cpd in optimal_decision_rules:
+            cpd.initialize_tabular_cpd(five_node)
+        self.assertEqual({rule.signature() for rule, eu in expected_utilities if eu == max_eu},
+                         {rule.signature() for rule in optimal_decision_rules})
+
+        # ties are exact, so small utilities still have a unique optimal decision rule
+        small_scale = CID([('S', 'D'), ('S', 'U'), ('D', 'U')], decision_nodes=['D'], utility_nodes=['U'])
+        small_scale.add_cpds(UniformRandomCPD('S', [0, 1]), DecisionDomain('D', [0, 1]),
+                             FunctionCPD('U', lambda s, d: 1e-9 * (d == s), evidence=['S', 'D']))
+        self.assertEqual(len(small_scale.optimal_pure_decision_rules('D')), 1)
+
     # @unittest.skip("")
     def test_is_s_reachable(self) -> None:
         example = taxi_competition()
@@ -218,6 +264,20 @@ class TestBASE(unittest.TestCase):
         cid_no_cpds = cid.copy_without_cpds()
         self.assertTrue(len(cid_no_cpds.cpds) == 0)
 
+    # @unittest.skip("")
+    def test_copy(self) -> None:
+        cid = get_3node_cid()
+        cid.impute_random_policy()
+        cid_copy = cid.copy()
+        for node in cid.nodes:
+            self.assertIsNot(cid_copy.get_cpds(node), cid.get_cpds(node))
+            self.assertTrue(np.array_equal(cid_copy.get_cpds(node).values, cid.get_cpds(node).values))
+        # changing the copy leaves the original unchanged
+        cid_copy.add_cpds(FunctionCPD('S', lambda: 2, evidence=[]))
+        self.assertCountEqual(cid_copy.get_cpds('U').state_names['U'], [-2, 2])
+        self.assertCountEqual(cid.get_cpds('U').state_names['U'], [-1, 1])
+        self.assertTrue(cid.check_model())
+
     # @unittest.skip("")
     def test_sufficient_recall(self) -> None:
         example = forgetful_movie_star()